@@ -2,15 +2,88 @@
 
 # Copyright 2024 Amazon.com and its affiliates; all rights reserved.
 # This file is AWS Content and may not be duplicated or distributed without permission
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Callable, Dict, Final, List
 import argparse
-import boto3
 sys.path.append(str(Path(__file__).parent.parent.parent.parent))
 
-from src.utils.bedrock_agent import Agent, SupervisorAgent, Task, Guardrail, region, account_id
+from src.utils.bedrock_agent import (
+    Agent,
+    SupervisorAgent,
+    Task,
+    Guardrail,
+    region,
+    agents_helper,
+)
 
-bedrock_client = boto3.client("bedrock")
+# Agent instructions are static, so define them once at module level
+NEWS_INSTRUCTIONS: Final[str] = (
+    "Top researcher in financial markets and company announcements."
+)
+STOCK_DATA_INSTRUCTIONS: Final[str] = (
+    "Specialist in real-time financial data extraction."
+)
+ANALYST_INSTRUCTIONS: Final[str] = (
+    "Experienced analyst providing strategic recommendations. "
+    "You take as input the news summary and stock price summary."
+)
+PORTFOLIO_INSTRUCTIONS: Final[str] = (
+    """
+    Act as a seasoned expert at analyzing a potential stock investment for a given 
+    stock ticker. Do your research to understand how the stock price has been moving 
+    lately, as well as recent news on the stock. Give back a well written and 
+    carefully considered report with considerations for a potential investor. 
+    You use your analyst collaborator to perform the final analysis, and you give 
+    the news and stock data to the analyst as input. Use your collaborators in sequence, not in parallel."""
+)
+
+
+def create_agents_concurrently(agent_specs: List[Dict]) -> List[Agent]:
+    """Creates independent agents in parallel, returning them in the order given.
+
+    Agent creation is dominated by Bedrock control-plane round-trips, so the
+    pool is sized for I/O-bound work rather than the executor's CPU default.
+    """
+    _max_workers = min(len(agent_specs), (os.cpu_count() or 1) * 5)
+    with ThreadPoolExecutor(max_workers=_max_workers) as executor:
+        return list(executor.map(lambda _spec: Agent.create(**_spec), agent_specs))
+
+
+def make_stream_printer(header: str) -> Callable[[str], None]:
+    """Returns a callback that writes streamed response chunks to the terminal as soon
+    as they arrive, printing the header just before the first chunk so that it follows
+    any trace output."""
+    _started = False
+
+    def _print_chunk(chunk: str) -> None:
+        nonlocal _started
+        if not _started:
+            print(header)
+            _started = True
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+
+    return _print_chunk
+
+
+def delete_agents_concurrently(agent_ids: Dict[str, str]) -> None:
+    """Deletes independent agents, given as {name: agent_id}, in parallel, waiting
+    until all are deleted."""
+    if not agent_ids:
+        return
+    _max_workers = min(len(agent_ids), (os.cpu_count() or 1) * 5)
+    with ThreadPoolExecutor(max_workers=_max_workers) as executor:
+        list(
+            executor.map(
+                lambda _item: Agent.delete_by_name(
+                    _item[0], verbose=True, agent_id=_item[1]
+                ),
+                agent_ids.items(),
+            )
+        )
 
 
 def main(args):
@@ -20,19 +93,33 @@ def main(args):
         Agent.set_force_recreate_default(False)
     else:
         Agent.set_force_recreate_default(True)
-        Agent.delete_by_name("portfolio_assistant", verbose=True)
+        # clean-up deletes the supervisor itself, from a single listing of agent ids
+        if args.clean_up != "true":
+            Agent.delete_by_name("portfolio_assistant", verbose=True)
     if args.clean_up == "true":
-        Agent.delete_by_name("portfolio_assistant", verbose=True)
-        Agent.delete_by_name("news_agent", verbose=True)
-        Agent.delete_by_name("stock_data_agent", verbose=True)
-        Agent.delete_by_name("analyst_agent", verbose=True)
-        response = bedrock_client.list_guardrails()
-        for _gr in response["guardrails"]:
-            if _gr["name"] == "no_bitcoin_guardrail":
-                print(f"Found guardrail: {_gr['id']}")
-                guardrail_identifier = _gr["id"]
-                bedrock_client.delete_guardrail(guardrailIdentifier=guardrail_identifier)
+        # Look up every agent id with a single listing rather than once per deletion.
+        _agent_ids = agents_helper.get_agent_ids_by_name()
+
+        # The supervisor must be gone before its collaborators can be deleted;
+        # the collaborators themselves can then be deleted concurrently.
+        if "portfolio_assistant" in _agent_ids:
+            Agent.delete_by_name(
+                "portfolio_assistant",
+                verbose=True,
+                agent_id=_agent_ids["portfolio_assistant"],
+            )
+        delete_agents_concurrently(
+            {
+                _name: _agent_ids[_name]
+                for _name in ["news_agent", "stock_data_agent", "analyst_agent"]
+                if _name in _agent_ids
+            }
+        )
+        Guardrail.delete_by_name("no_bitcoin_guardrail", verbose=True)
     else:
+        # only needed for the tool ARNs, so clean-up runs skip the STS lookup
+        account_id = agents_helper.get_account_id()
+
         # Define a new Guardrail
         no_bitcoin_guardrail = Guardrail(
             "no_bitcoin_guardrail",
@@ -44,11 +131,11 @@ def main(args):
         )
 
         # Define News Agent
-        news_agent = Agent.create(
+        news_agent_spec = dict(
             name="news_agent",
             role="Market News Researcher",
             goal="Fetch latest relevant news for a given stock based on a ticker.",
-            instructions="Top researcher in financial markets and company announcements.",
+            instructions=NEWS_INSTRUCTIONS,
             tool_code=f"arn:aws:lambda:{region}:{account_id}:function:web_search",
             tool_defs=[
                 {
@@ -81,11 +168,11 @@ def main(args):
         )
 
         # Define Stock Data Agent
-        stock_data_agent = Agent.create(
+        stock_data_agent_spec = dict(
             name="stock_data_agent",
             role="Financial Data Collector",
             goal="Retrieve accurate stock trends for a given ticker.",
-            instructions="Specialist in real-time financial data extraction.",
+            instructions=STOCK_DATA_INSTRUCTIONS,
             tool_code=f"arn:aws:lambda:{region}:{account_id}:function:stock_data_lookup",
             tool_defs=[
                 {  # lambda_layers: yfinance_layer.zip, numpy_layer.zip
@@ -103,11 +190,17 @@ def main(args):
         )
 
         # Define Analyst Agent
-        analyst_agent = Agent.create(
+        analyst_agent_spec = dict(
             name="analyst_agent",
             role="Financial Analyst",
             goal="Analyze stock trends and market news to generate insights.",
-            instructions="Experienced analyst providing strategic recommendations. You take as input the news summary and stock price summary.",
+            instructions=ANALYST_INSTRUCTIONS,
+        )
+
+        # The collaborators do not depend on each other, so create them concurrently
+        # and only join before the supervisor needs their alias ARNs.
+        news_agent, stock_data_agent, analyst_agent = create_agents_concurrently(
+            [news_agent_spec, stock_data_agent_spec, analyst_agent_spec]
         )
 
         # Create Tasks
@@ -144,13 +237,7 @@ def main(args):
             role="Portfolio Assistant",
             goal="Analyze a given potential stock investment and provide a report with a set of investment considerations",
             collaboration_type="SUPERVISOR",
-            instructions="""
-                    Act as a seasoned expert at analyzing a potential stock investment for a given 
-                    stock ticker. Do your research to understand how the stock price has been moving 
-                    lately, as well as recent news on the stock. Give back a well written and 
-                    carefully considered report with considerations for a potential investor. 
-                    You use your analyst collaborator to perform the final analysis, and you give 
-                    the news and stock data to the analyst as input. Use your collaborators in sequence, not in parallel.""",
+            instructions=PORTFOLIO_INSTRUCTIONS,
             collaborator_agents=[
                 {
                     "agent": "news_agent",
@@ -180,6 +267,7 @@ def main(args):
                 processing_type="sequential",
                 enable_trace=True,
                 trace_level=args.trace_level,
+                performance_config=args.performance_config,
             )
             print(result)
 
@@ -197,10 +285,16 @@ def main(args):
             request = "what's AMZN stock price doing over the last week and relate that to recent news"
             print(f"Request:\n{request}\n")
 
-            result = portfolio_assistant.invoke(
-                request, enable_trace=True, trace_level=args.trace_level
+            # stream the final answer to the terminal as it is generated, rather than
+            # waiting for the whole supervisor chain to finish before printing it.
+            portfolio_assistant.invoke(
+                request,
+                enable_trace=True,
+                trace_level=args.trace_level,
+                performance_config=args.performance_config,
+                stream_final_response=True,
+                stream_callback=make_stream_printer("Final answer:"),
             )
-            print(f"Final answer:\n{result}")
 
         else:
             print("Recreated agents.")
@@ -223,6 +317,14 @@ if __name__ == "__main__":
         default="core",
         help="The level of trace, 'core', 'outline', 'all'.",
     )
+    parser.add_argument(
+        "--performance_config",
+        required=False,
+        default=None,
+        choices=["standard", "optimized"],
+        help="Model latency setting for invocations, 'standard' or 'optimized'. Not sent unless set; "
+        "'optimized' only helps models that support latency-optimized inference.",
+    )
     parser.add_argument(
         "--clean_up",
         required=False,
@@ -33,24 +33,39 @@ from dataclasses import dataclass
 from typing import Self, Callable, Union
 from enum import Enum
 import yaml
-from src.utils.bedrock_agent_helper import AgentsForAmazonBedrock
+from src.utils.bedrock_agent_helper import AgentsForAmazonBedrock, DEFAULT_BOTO_CONFIG
 import json
 
 print(f"boto3 version: {boto3.__version__}")
 
-# Clients
-s3_client = boto3.client("s3")
-sts_client = boto3.client("sts")
-bedrock_agent_client = boto3.client("bedrock-agent")
-bedrock_agent_runtime_client = boto3.client("bedrock-agent-runtime")
-bedrock_client = boto3.client("bedrock")
-agents_helper = AgentsForAmazonBedrock()
+# Clients, all created from one shared session
+boto_session = boto3.session.Session()
+s3_client = boto_session.client("s3", config=DEFAULT_BOTO_CONFIG)
+sts_client = boto_session.client("sts", config=DEFAULT_BOTO_CONFIG)
+bedrock_agent_client = boto_session.client("bedrock-agent", config=DEFAULT_BOTO_CONFIG)
+bedrock_agent_runtime_client = boto_session.client(
+    "bedrock-agent-runtime", config=DEFAULT_BOTO_CONFIG
+)
+bedrock_client = boto_session.client("bedrock", config=DEFAULT_BOTO_CONFIG)
+agents_helper = AgentsForAmazonBedrock(
+    boto3_session=boto_session, boto_config=DEFAULT_BOTO_CONFIG
+)
 
 region = agents_helper.get_region()
-account_id = sts_client.get_caller_identity()["Account"]
 
-suffix = f"{region}-{account_id}"
-bucket_name = f"mac-workshop-{suffix}"
+
+def __getattr__(name: str):
+    # account_id costs an STS round-trip, so it and the names derived from it are only
+    # resolved when first accessed rather than on import
+    if name == "account_id":
+        return agents_helper.get_account_id()
+    if name == "suffix":
+        return f"{region}-{agents_helper.get_account_id()}"
+    if name == "bucket_name":
+        return f"mac-workshop-{__getattr__('suffix')}"
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 agent_foundation_models = [
     "us.anthropic.claude-3-haiku-20240307-v1:0",
     "us.anthropic.claude-3-sonnet-20240307-v1:0",
@@ -156,16 +171,14 @@ class Guardrail:
         self.name = name
 
         # see if Guardrail already exists
-        resp = bedrock_client.list_guardrails()
         if verbose:
-            print(f"Found {len(resp['guardrails'])} guardrails: {resp['guardrails']}")
             print(f"Looking for guardrail: {self.name}")
-        for _gr in resp["guardrails"]:
-            if _gr["name"] == self.name:
-                if verbose:
-                    print(f"Found guardrail: {_gr['id']}")
-                self.guardrail_id = _gr["id"]
-                return
+        _guardrail_id = Guardrail.find_id_by_name(self.name)
+        if _guardrail_id is not None:
+            if verbose:
+                print(f"Found guardrail: {_guardrail_id}")
+            self.guardrail_id = _guardrail_id
+            return
 
         # create new Guardrail
         resp = bedrock_client.create_guardrail(
@@ -187,6 +200,31 @@ class Guardrail:
             print(f"Guardrail created: {resp}")
         self.guardrail_id = resp["guardrailId"]
 
+    @classmethod
+    def find_id_by_name(cls, name: str) -> Optional[str]:
+        """Return the id of the guardrail with the given name, or None if not found.
+
+        GetGuardrail only accepts an id or ARN, so this pages through the guardrails
+        and stops at the first match rather than listing all of them."""
+        _paginator = bedrock_client.get_paginator("list_guardrails")
+        for _page in _paginator.paginate():
+            for _gr in _page["guardrails"]:
+                if _gr["name"] == name:
+                    return _gr["id"]
+        return None
+
+    @classmethod
+    def delete_by_name(cls, name: str, verbose: bool = False):
+        """Delete the guardrail by name, if it exists"""
+        _guardrail_id = cls.find_id_by_name(name)
+        if _guardrail_id is None:
+            if verbose:
+                print(f"Guardrail {name} not found")
+            return
+        if verbose:
+            print(f"Found guardrail: {_guardrail_id}")
+        bedrock_client.delete_guardrail(guardrailIdentifier=_guardrail_id)
+
 
 class Tool:
     """A tool that can be attached to an agent."""
@@ -434,24 +472,10 @@ class Agent:
                     )
                     _tool_num += 1
 
-        # Add an agent alias so that this agent can be used as a sub agent by a supervisor.
-
-        agents_helper.wait_agent_status_update(
-            self.agent_id
-        )  # wait to be out of "Versioning" state
-        agents_helper.prepare(self.name)
-        agents_helper.wait_agent_status_update(self.agent_id)
-        _agent_alias = agents_helper._bedrock_agent_client.create_agent_alias(
-            agentAliasName="with-code-ag", agentId=self.agent_id
+        # Prepare the agent and add an alias so that this agent can be used as a sub agent by a supervisor.
+        self.agent_alias_id, self.agent_alias_arn = agents_helper.make_agent_ready(
+            self.agent_id, "with-code-ag"
         )
-        self.agent_alias_id = _agent_alias["agentAlias"]["agentAliasId"]
-        self.agent_alias_arn = _agent_alias["agentAlias"]["agentAliasArn"]
-
-        agents_helper.wait_agent_status_update(
-            self.agent_id
-        )  # wait to be out of "Versioning" state
-        agents_helper.prepare(self.name)
-        agents_helper.wait_agent_status_update(self.agent_id)
 
         print(
             f"DONE: Agent: {self.name}, id: {self.agent_id}, alias id: {self.agent_alias_id}\n"
@@ -468,8 +492,7 @@ class Agent:
 
     def needs_preparation(self) -> bool:
         """Return True if the agent needs to be prepared"""
-        bedrock_agent = boto3.client("bedrock-agent")
-        response = bedrock_agent.get_agent(agentId=self.agent_id)
+        response = bedrock_agent_client.get_agent(agentId=self.agent_id)
         agent_info = response["agent"]
 
         # Check if never prepared
@@ -484,13 +507,9 @@ class Agent:
         """Prepare the agent for use (some operations will do this implicitly if needed)"""
         print("Preparing agent")
         if self.needs_preparation():
-            agents_helper.prepare(self.name)
-            agents_helper.wait_agent_status_update(self.agent_id)
-            _agent_alias = agents_helper._bedrock_agent_client.create_agent_alias(
-                agentAliasName=alias, agentId=self.agent_id
+            self.agent_alias_id, self.agent_alias_arn = agents_helper.make_agent_ready(
+                self.agent_id, alias
             )
-            self.agent_alias_id = _agent_alias["agentAlias"]["agentAliasId"]
-            self.agent_alias_arn = _agent_alias["agentAlias"]["agentAliasArn"]
         else:
             print("Agent already prepared")
 
@@ -590,6 +609,9 @@ class Agent:
         enable_trace: bool = False,
         trace_level: str = "none",
         multi_agent_names: dict = {},
+        performance_config: str = None,
+        stream_final_response: bool = False,
+        stream_callback: Callable[[str], None] = None,
     ):
         """Invoke the agent with the given input text"""
         # if self.needs_preparation():
@@ -603,6 +625,9 @@ class Agent:
             enable_trace=enable_trace,
             trace_level=trace_level,
             multi_agent_names=multi_agent_names,
+            performance_config=performance_config,
+            stream_final_response=stream_final_response,
+            stream_callback=stream_callback,
         )
 
     def invoke_roc(
@@ -777,9 +802,13 @@ class Agent:
         agents_helper.delete_agent(self.name, delete_role_flag=True, verbose=verbose)
 
     @classmethod
-    def delete_by_name(cls, agent_name: str, verbose: bool = False):
-        """Delete the agent by name"""
-        agents_helper.delete_agent(agent_name, delete_role_flag=True, verbose=verbose)
+    def delete_by_name(
+        cls, agent_name: str, verbose: bool = False, agent_id: str = None
+    ):
+        """Delete the agent by name (pass agent_id if already known to skip the lookup)"""
+        agents_helper.delete_agent(
+            agent_name, delete_role_flag=True, verbose=verbose, agent_id=agent_id
+        )
 
     @classmethod
     def exists(cls, agent_name: str):
@@ -978,7 +1007,7 @@ class SupervisorAgent:
             agents_helper.wait_agent_status_update(
                 self.supervisor_agent_id
             )  # wait to be out of "Versioning" state
-            agents_helper.prepare(self.name)
+            agents_helper.prepare_by_id(self.supervisor_agent_id)
             agents_helper.wait_agent_status_update(
                 self.supervisor_agent_id
             )  # wait to be out of "Preparing" state
@@ -1087,6 +1116,9 @@ class SupervisorAgent:
         trace_level: str = "core",
         session_state: dict = {},
         multi_agent_names: dict = {},
+        performance_config: str = None,
+        stream_final_response: bool = False,
+        stream_callback: Callable[[str], None] = None,
     ):
         if multi_agent_names == {}:
             multi_agent_names = self.multi_agent_names
@@ -1099,6 +1131,9 @@ class SupervisorAgent:
             session_state=session_state,
             trace_level=trace_level,
             multi_agent_names=multi_agent_names,
+            performance_config=performance_config,
+            stream_final_response=stream_final_response,
+            stream_callback=stream_callback,
         )
 
     def invoke_with_tasks(
@@ -1109,6 +1144,9 @@ class SupervisorAgent:
         enable_trace: bool = False,
         trace_level: str = "none",
         verbose: bool = False,
+        performance_config: str = None,
+        stream_final_response: bool = False,
+        stream_callback: Callable[[str], None] = None,
     ):
         prompt = ""
         if processing_type == "sequential":
@@ -1158,6 +1196,9 @@ be sure to include the details as input to the task.\n\n"""
             enable_trace=enable_trace,
             trace_level=trace_level,
             multi_agent_names=self.multi_agent_names,
+            performance_config=performance_config,
+            stream_final_response=stream_final_response,
+            stream_callback=stream_callback,
         )
         return result
 
@@ -11,6 +11,7 @@ import copy
 
 import boto3
 import json
+import random
 import time
 import uuid
 import zipfile
@@ -20,6 +21,8 @@ import datetime
 from io import BytesIO
 from typing import List, Dict, Tuple
 import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
 from boto3.session import Session
 from botocore.config import Config
 from boto3.dynamodb.conditions import Key
@@ -52,6 +55,31 @@ UNDECIDABLE_CLASSIFICATION = "undecidable"
 ROUTER_MODEL = "us.anthropic.claude-3-haiku-20240307-v1:0"
 TRACE_TRUNCATION_LENGTH = 300
 
+# Larger connection pool for concurrent agent operations, and adaptive retries so that
+# bursts of control-plane calls back off on throttling instead of failing
+DEFAULT_BOTO_CONFIG = Config(
+    max_pool_connections=50,
+    retries={"mode": "adaptive", "max_attempts": 10},
+    tcp_keepalive=True,
+)
+
+# Exponential backoff used when polling agent / alias status transitions, giving up
+# after a bounded number of polls
+STATUS_POLL_INITIAL_DELAY = 3
+STATUS_POLL_BACKOFF_MULTIPLIER = 1.5
+STATUS_POLL_MAX_DELAY = 10
+STATUS_POLL_MAX_ATTEMPTS = 60
+
+
+def _status_poll_delay(attempt: int) -> float:
+    """Returns the jittered backoff delay in seconds before the given poll attempt"""
+    _delay = min(
+        STATUS_POLL_MAX_DELAY,
+        STATUS_POLL_INITIAL_DELAY * STATUS_POLL_BACKOFF_MULTIPLIER**attempt,
+    )
+    return random.uniform(_delay * 0.9, _delay)
+
+
 # TODO: Take advantage of a default execution role so that we do not need to have lengthy
 # waiting times when creating a new Agent or new Lambda to give time for the IAM role to
 # take effect. When this is supported, need to change the default "delete_role_flag" to False
@@ -135,32 +163,67 @@ DEFAULT_AGENT_IAM_POLICY = {
 class AgentsForAmazonBedrock:
     """Provides an easy to use wrapper for Agents for Amazon Bedrock."""
 
-    def __init__(self):
-        """Constructs an instance."""
-        self._boto_session = Session()
+    def __init__(self, boto3_session: Session = None, boto_config: Config = None):
+        """Constructs an instance.
+
+        Args:
+            boto3_session (Session, Optional): session to create all clients from, so that callers
+            can share one credential chain and set of loaded service models. Defaults to a new Session.
+            boto_config (Config, Optional): botocore config applied to every client, e.g. to size the
+            connection pool for concurrent agent operations. Defaults to DEFAULT_BOTO_CONFIG.
+        """
+        self._boto_session = boto3_session if boto3_session is not None else Session()
         self._region = self._boto_session.region_name
-        self._account_id = boto3.client("sts").get_caller_identity()["Account"]
+        _config = boto_config if boto_config is not None else DEFAULT_BOTO_CONFIG
 
-        self._bedrock_agent_client = boto3.client("bedrock-agent")
+        self._sts_client = self._boto_session.client("sts", config=_config)
+        self._account_id_value = None  # resolved on first use, see _account_id
 
-        long_invoke_time_config = Config(read_timeout=600)
-        self._bedrock_agent_runtime_client = boto3.client(
+        self._bedrock_agent_client = self._boto_session.client(
+            "bedrock-agent", config=_config
+        )
+
+        long_invoke_time_config = _config.merge(Config(read_timeout=600))
+        self._bedrock_agent_runtime_client = self._boto_session.client(
             "bedrock-agent-runtime", config=long_invoke_time_config
         )
 
-        self._sts_client = boto3.client("sts")
-        self._iam_client = boto3.client("iam")
-        self._lambda_client = boto3.client("lambda")
-        self._s3_client = boto3.client("s3", region_name=self._region)
-        self._dynamodb_client = boto3.client("dynamodb", region_name=self._region)
-        self._dynamodb_resource = boto3.resource("dynamodb", region_name=self._region)
+        self._iam_client = self._boto_session.client("iam", config=_config)
+        self._lambda_client = self._boto_session.client("lambda", config=_config)
+        self._s3_client = self._boto_session.client(
+            "s3", region_name=self._region, config=_config
+        )
+        self._dynamodb_client = self._boto_session.client(
+            "dynamodb", region_name=self._region, config=_config
+        )
+        self._dynamodb_resource = self._boto_session.resource(
+            "dynamodb", region_name=self._region, config=_config
+        )
+
+        # agent name -> agent id for agents created through this instance, so that the
+        # follow-up calls that take an agent name don't each need a list_agents lookup
+        self._agent_id_cache: Dict[str, str] = {}
+
+    @property
+    def _account_id(self) -> str:
+        """The AWS account id. Resolving it costs an STS round-trip, so that is deferred
+        until something actually needs it (e.g. not for deleting agents)."""
+        if self._account_id_value is None:
+            self._account_id_value = self._sts_client.get_caller_identity()["Account"]
+        return self._account_id_value
 
-        self._suffix = f"{self._region}-{self._account_id}"
+    @property
+    def _suffix(self) -> str:
+        return f"{self._region}-{self._account_id}"
 
     def get_region(self) -> str:
         """Returns the region for this instance."""
         return self._region
 
+    def get_account_id(self) -> str:
+        """Returns the AWS account id for this instance."""
+        return self._account_id
+
     def _create_lambda_iam_role(
         self,
         agent_name: str,
@@ -357,15 +420,36 @@ class AgentsForAmazonBedrock:
         Returns:
             str: Agent ID, or None if not found
         """
-        _get_agents_resp = self._bedrock_agent_client.list_agents(maxResults=100)
-        _agents_json = _get_agents_resp["agentSummaries"]
-        _target_agent = next(
-            (agent for agent in _agents_json if agent["agentName"] == agent_name), None
-        )
-        if _target_agent is None:
-            return None
-        else:
-            return _target_agent["agentId"]
+        if agent_name in self._agent_id_cache:
+            return self._agent_id_cache[agent_name]
+
+        _paginator = self._bedrock_agent_client.get_paginator("list_agents")
+        for _page in _paginator.paginate(PaginationConfig={"PageSize": 100}):
+            _target_agent = next(
+                (
+                    agent
+                    for agent in _page["agentSummaries"]
+                    if agent["agentName"] == agent_name
+                ),
+                None,
+            )
+            if _target_agent is not None:
+                return _target_agent["agentId"]
+        return None
+
+    def get_agent_ids_by_name(self) -> Dict[str, str]:
+        """Gets the Agent IDs of all agents in the account, keyed by agent name, with a
+        single listing. Useful when looking up several agents at once.
+
+        Returns:
+            Dict[str, str]: Agent ID for each agent name
+        """
+        _paginator = self._bedrock_agent_client.get_paginator("list_agents")
+        return {
+            agent["agentName"]: agent["agentId"]
+            for _page in _paginator.paginate(PaginationConfig={"PageSize": 100})
+            for agent in _page["agentSummaries"]
+        }
 
     def associate_kb_with_agent(self, agent_id, description, kb_id):
         """Associates a Knowledge Base with an Agent, and prepares the agent.
@@ -575,8 +659,39 @@ class AgentsForAmazonBedrock:
         else:
             return "Agent not found"
 
+    def _delete_agent_aliases(self, agent_id: str) -> None:
+        """Deletes all aliases of an agent other than the test alias, concurrently.
+
+        Args:
+            agent_id (str): Id of the agent whose aliases are to be deleted
+        """
+        _agent_aliases = self._bedrock_agent_client.list_agent_aliases(
+            agentId=agent_id, maxResults=100
+        )
+        _alias_ids = [
+            alias["agentAliasId"]
+            for alias in _agent_aliases["agentAliasSummaries"]
+            if alias["agentAliasId"] != DEFAULT_ALIAS
+        ]
+        if not _alias_ids:
+            return
+
+        def _delete_alias(alias_id: str):
+            print(f"Deleting alias {alias_id} from agent {agent_id}")
+            return self._bedrock_agent_client.delete_agent_alias(
+                agentAliasId=alias_id, agentId=agent_id
+            )
+
+        with ThreadPoolExecutor(max_workers=min(16, len(_alias_ids))) as executor:
+            # consume the results so that any deletion error is raised here
+            list(executor.map(_delete_alias, _alias_ids))
+
     def delete_agent(
-        self, agent_name: str, delete_role_flag: bool = True, verbose: bool = False
+        self,
+        agent_name: str,
+        delete_role_flag: bool = True,
+        verbose: bool = False,
+        agent_id: str = None,
     ) -> None:
         """Deletes an existing agent. Optionally, deletes the IAM role associated with the agent.
 
@@ -584,55 +699,42 @@ class AgentsForAmazonBedrock:
             agent_name (str): Name of the agent to delete.
             delete_role_flag (bool, Optional): Flag indicating whether to delete the IAM role associated with the agent.
             Defaults to True.
+            agent_id (str, Optional): Id of the agent, if already known, to skip looking it up by name.
         """
 
-        # first find the agent ID from the agent Name
-        _get_agents_resp = self._bedrock_agent_client.list_agents(maxResults=100)
-        _agents_json = _get_agents_resp["agentSummaries"]
-        _target_agent = next(
-            (agent for agent in _agents_json if agent["agentName"] == agent_name), None
-        )
+        # first find the agent ID from the agent Name, unless the caller already has it
+        if agent_id is None:
+            agent_id = self.get_agent_id_by_name(agent_name)
 
-        if _target_agent is None:
+        if agent_id is None:
             print(f"Agent {agent_name} not found")
             return
 
-        if _target_agent is not None and verbose:
-            print(
-                f"Found target agent, name: {agent_name}, id: {_target_agent['agentId']}"
-            )
+        if verbose:
+            print(f"Found target agent, name: {agent_name}, id: {agent_id}")
 
         # Delete the agent aliases
-        if _target_agent is not None:
-            _agent_id = _target_agent["agentId"]
-            if verbose:
-                print(f"Deleting aliases for agent {_agent_id}...")
-
-            try:
-                _agent_aliases = self._bedrock_agent_client.list_agent_aliases(
-                    agentId=_agent_id, maxResults=100
-                )
-                for alias in _agent_aliases["agentAliasSummaries"]:
-                    alias_id = alias["agentAliasId"]
-                    if alias_id == "TSTALIASID":
-                        continue
-                    print(f"Deleting alias {alias_id} from agent {_agent_id}")
-                    response = self._bedrock_agent_client.delete_agent_alias(
-                        agentAliasId=alias_id, agentId=_agent_id
-                    )
-            except Exception as e:
-                print(f"Error deleting aliases: {e}")
-                pass
+        if verbose:
+            print(f"Deleting aliases for agent {agent_id}...")
 
-        # if the agent exists, delete the agent
-        if _target_agent is not None:
-            _agent_id = _target_agent["agentId"]
+        # aliases already gone are fine; any other failure must stop us from deleting
+        # an agent that still has aliases
+        with suppress(self._bedrock_agent_client.exceptions.ResourceNotFoundException):
+            self._delete_agent_aliases(agent_id)
 
-            if verbose:
-                print(f"Deleting agent: {_agent_id}...")
-            time.sleep(5)
-            self._bedrock_agent_client.delete_agent(agentId=_agent_id)
-            time.sleep(5)
+        # delete the agent itself
+        if verbose:
+            print(f"Deleting agent: {agent_id}...")
+        time.sleep(5)
+        try:
+            self._bedrock_agent_client.delete_agent(agentId=agent_id)
+        except self._bedrock_agent_client.exceptions.ResourceNotFoundException:
+            # the id was cached or supplied by the caller, but the agent is already gone
+            self._agent_id_cache.pop(agent_name, None)
+            print(f"Agent {agent_name} not found")
+            return
+        self._agent_id_cache.pop(agent_name, None)
+        time.sleep(5)
 
         # TODO: add delete_lambda_flag parameter to optionall take care of
         # deleting the lambda function associated with the agent.
@@ -643,31 +745,21 @@ class AgentsForAmazonBedrock:
             if verbose:
                 print(f"Deleting IAM role: {_agent_role_name}...")
 
-            try:
-                self._iam_client.delete_role_policy(
-                    PolicyName="bedrock_gr_allow_policy", RoleName=_agent_role_name
-                )
-            except Exception as e:
-                pass
-
-            try:
-                self._iam_client.delete_role_policy(
-                    PolicyName="bedrock_allow_policy", RoleName=_agent_role_name
-                )
-            except Exception as e:
-                pass
-
-            try:
-                self._iam_client.delete_role_policy(
-                    PolicyName="bedrock_kb_allow_policy", RoleName=_agent_role_name
-                )
-            except Exception as e:
-                pass
+            # the role or any of its inline policies may legitimately be absent; anything
+            # else is a real failure and should surface
+            _not_found = self._iam_client.exceptions.NoSuchEntityException
+            for _policy_name in [
+                "bedrock_gr_allow_policy",
+                "bedrock_allow_policy",
+                "bedrock_kb_allow_policy",
+            ]:
+                with suppress(_not_found):
+                    self._iam_client.delete_role_policy(
+                        PolicyName=_policy_name, RoleName=_agent_role_name
+                    )
 
-            try:
+            with suppress(_not_found):
                 self._iam_client.delete_role(RoleName=_agent_role_name)
-            except Exception as e:
-                pass
 
         return
 
@@ -820,12 +912,23 @@ class AgentsForAmazonBedrock:
             return _agent_role["Role"]["Arn"]
 
     def wait_agent_status_update(self, agent_id):
+        """Waits for an agent to leave any transitional (*ING) status, polling with
+        exponential backoff. Raises TimeoutError if it is still transitioning after
+        STATUS_POLL_MAX_ATTEMPTS polls."""
         response = self._bedrock_agent_client.get_agent(agentId=agent_id)
         agent_status = response["agent"]["agentStatus"]
         _waited_at_least_once = False
+        _attempt = 0
         while agent_status.endswith("ING"):
-            print(f"Waiting for agent status to change. Current status {agent_status}")
-            time.sleep(5)
+            if _attempt >= STATUS_POLL_MAX_ATTEMPTS:
+                raise TimeoutError(
+                    f"Agent id {agent_id} still {agent_status} after {_attempt} status checks"
+                )
+            print(
+                f"Waiting for agent id {agent_id} status to change. Current status {agent_status}"
+            )
+            time.sleep(_status_poll_delay(_attempt))
+            _attempt += 1
             _waited_at_least_once = True
             try:
                 response = self._bedrock_agent_client.get_agent(agentId=agent_id)
@@ -840,19 +943,26 @@ class AgentsForAmazonBedrock:
             agentId=agent_id, agentAliasId=agent_alias_id
         )
         agent_alias_status = response["agentAlias"]["agentAliasStatus"]
+        _attempt = 0
         while agent_alias_status.endswith("ING"):
+            if _attempt >= STATUS_POLL_MAX_ATTEMPTS:
+                raise TimeoutError(
+                    f"Agent id {agent_id}, Alias {agent_alias_id} still {agent_alias_status} "
+                    + f"after {_attempt} status checks"
+                )
             if verbose:
                 print(
                     f"Waiting for agent ALIAS status to change. Current status {agent_alias_status}"
                 )
-            time.sleep(5)
+            time.sleep(_status_poll_delay(_attempt))
+            _attempt += 1
             try:
                 response = self._bedrock_agent_client.get_agent_alias(
                     agentId=agent_id, agentAliasId=agent_alias_id
                 )
                 agent_alias_status = response["agentAlias"]["agentAliasStatus"]
             except self._bedrock_agent_client.exceptions.ResourceNotFoundException:
-                agent_status = "DELETED"
+                agent_alias_status = "DELETED"
         if verbose:
             print(
                 f"Agent id {agent_id}, Alias {agent_alias_id} current status: {agent_alias_status}"
@@ -873,9 +983,24 @@ class AgentsForAmazonBedrock:
                     relayConversationHistory=sub_agent["relay_conversation_history"],
                 )
             )
-            self.wait_agent_status_update(supervisor_agent_id)
-            self._bedrock_agent_client.prepare_agent(agentId=supervisor_agent_id)
-            self.wait_agent_status_update(supervisor_agent_id)
+
+        # Prepare once, after all collaborators are associated, rather than after each one.
+        # Bedrock serializes agent mutations, so prepare can be issued right away and only
+        # needs a short retry if the last association has not settled yet.
+        _num_tries = 0
+        while True:
+            try:
+                self.prepare_by_id(supervisor_agent_id)
+                break
+            except (
+                self._bedrock_agent_client.exceptions.ValidationException,
+                self._bedrock_agent_client.exceptions.ConflictException,
+            ):
+                _num_tries += 1
+                if _num_tries > 3:
+                    raise
+                time.sleep(0.5 * _num_tries)
+        self.wait_agent_status_update(supervisor_agent_id)
 
         supervisor_agent_alias = self._bedrock_agent_client.create_agent_alias(
             agentAliasName="multi-agent", agentId=supervisor_agent_id
@@ -992,6 +1117,7 @@ class AgentsForAmazonBedrock:
                     **_kwargs,
                 )
                 _agent_id = _create_agent_response["agent"]["agentId"]
+                self._agent_id_cache[agent_name] = _agent_id
                 if verbose:
                     print(f"Created agent, resulting id: {_agent_id}")
                     _get_resp = self._bedrock_agent_client.get_agent(agentId=_agent_id)
@@ -1030,10 +1156,20 @@ class AgentsForAmazonBedrock:
         if _agent_id is None:
             return "Agent not found"
 
-        _resp = self._bedrock_agent_client.prepare_agent(agentId=_agent_id)
+        self.prepare_by_id(_agent_id)
         time.sleep(5)  # make sure agent is ready to be invoked as soon as we return
         return
 
+    def prepare_by_id(self, agent_id: str) -> None:
+        """Starts preparing an agent for invocation, for callers that already hold the
+        agent id. Unlike prepare(), this neither looks the agent up by name nor sleeps;
+        use wait_agent_status_update() to wait for preparation to finish.
+
+        Args:
+            agent_id (str): id of the existing agent
+        """
+        self._bedrock_agent_client.prepare_agent(agentId=agent_id)
+
     def create_agent_alias(self, agent_id: str, alias_name: str) -> Tuple[str, str]:
         """Creates an agent alias. This is required to use the agent as a sub-agent for
         multi-agent collaboration.
@@ -1049,6 +1185,27 @@ class AgentsForAmazonBedrock:
         agent_alias_arn = agent_alias["agentAlias"]["agentAliasArn"]
         return agent_alias_id, agent_alias_arn
 
+    def make_agent_ready(self, agent_id: str, alias_name: str) -> Tuple[str, str]:
+        """Prepares an agent and creates an alias for it in one step, waiting only where
+        the next call requires it. The agent is then ready to be invoked through the
+        alias, or used as a sub-agent for multi-agent collaboration.
+
+        Args:
+            agent_id (str): id of the existing agent
+            alias_name (str): name of the alias to create
+
+        Returns:
+            Tuple[str, str]: id and ARN of the new alias
+        """
+        self.wait_agent_status_update(agent_id)  # be sure agent is not still updating
+        self.prepare_by_id(agent_id)
+        self.wait_agent_status_update(agent_id)  # wait to be out of "Preparing" state
+        _agent_alias_id, _agent_alias_arn = self.create_agent_alias(
+            agent_id, alias_name
+        )
+        self.wait_agent_alias_status_update(agent_id, _agent_alias_id)
+        return _agent_alias_id, _agent_alias_arn
+
     def add_code_interpreter(self, agent_name: str) -> None:
         """Adds a code interpreter action group to an existing agent, and prepares
         the agent so it is ready to be invoked.
@@ -2013,6 +2170,8 @@ class AgentsForAmazonBedrock:
         trace_level: str = "core",
         multi_agent_names: dict = {},
         stream_final_response: bool = False,
+        performance_config: str = None,
+        stream_callback: Callable[[str], None] = None,
     ):
         """Invokes an agent with a given input text, while optional parameters
         also let you leverage an agent session, or target a specific agent alias.
@@ -2026,6 +2185,11 @@ class AgentsForAmazonBedrock:
             enable_trace (bool, optional): Whether to enable trace. Defaults to False.
             end_session (bool, optional): Whether to end the session. Defaults to False.
             trace_level (str, optional): The level of trace. Defaults to "none". Possible values are "none", "all", "core".
+            performance_config (str, optional): Model latency setting, "standard" or "optimized". Defaults to None,
+            which leaves the service default in place.
+            stream_final_response (bool, optional): Whether to stream the final response in chunks. Defaults to False.
+            stream_callback (Callable[[str], None], optional): Called with each answer chunk as soon as it arrives,
+            e.g. to print a streamed final response. Defaults to None.
 
         Returns:
             str: The answer from the agent.
@@ -2033,6 +2197,12 @@ class AgentsForAmazonBedrock:
 
         _time_before_call = datetime.datetime.now()
 
+        _kwargs = {}
+        if performance_config is not None:
+            _kwargs["bedrockModelConfigurations"] = {
+                "performanceConfig": {"latency": performance_config}
+            }
+
         _agent_resp = self._bedrock_agent_runtime_client.invoke_agent(
             inputText=input_text,
             agentId=agent_id,
@@ -2042,6 +2212,7 @@ class AgentsForAmazonBedrock:
             enableTrace=enable_trace,
             endSession=end_session,
             streamingConfigurations={"streamFinalResponse": stream_final_response},
+            **_kwargs,
         )
 
         if enable_trace:
@@ -2103,7 +2274,9 @@ class AgentsForAmazonBedrock:
                             )
                     _num_response_chunks += 1
 
-                    if (
+                    if stream_callback is not None:
+                        stream_callback(_tmp_agent_answer)
+                    elif (
                         enable_trace
                         and stream_final_response
                         and _num_response_chunks < 3
@@ -2560,6 +2733,10 @@ class AgentsForAmazonBedrock:
                         #     # plt.imshow(img)
                         #     # plt.show()
 
+            # end the streamed answer so that any summary below starts on its own line
+            if stream_callback is not None and _num_response_chunks > 0:
+                print()
+
             if enable_trace:
                 duration = datetime.datetime.now() - _time_before_call
 